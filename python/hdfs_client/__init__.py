@@ -1,36 +1,67 @@
 import logging
 import os
+import re
 import shutil
-import json
+import threading
+from contextlib import closing
 from os import path as os_path
 from os.path import join as path_join
 from uuid import uuid1
 from time import time
 from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 
 import requests
 from requests import RequestException
-from requests.compat import urljoin
 
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    try:
+        from ujson import loads as json_loads
+    except ImportError:
+        from json import loads as json_loads
+
+from .adapters import SendfileAdapter
 from .exceptions import ActiveNamenodeNotFoundException
 from .request_wrapper import RetryAction, ResultValue, empty_trigger
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_POOL_CONNECTIONS = 64
+DEFAULT_POOL_MAXSIZE = 64
+DEFAULT_MAX_WORKERS = 8
+LIST_MAX_WORKERS = 4
+UPLOAD_BUFFER_SIZE = 1024 * 1024
+DOWNLOAD_BUFFER_SIZE = 1024 * 1024
+STAT_CACHE_TTL = 2
+STAT_CACHE_SIZE = 1024
+NAMENODE_STATUS_TIMEOUT = (1, 2)
+NAMENODE_STATUS_CHUNK_SIZE = 4096
+NAMENODE_ACTIVE_PATTERN = re.compile(br'"State"\s*:\s*"active"')
+
 NameNode = namedtuple('NameNode', ['host', 'port'])
 HDFSData = namedtuple('HDFSData', ['dirs', 'files'])
 
 
 class QueryURL(object):
     NAMENODE_STATUS = 'http://{host}:{port}/jmx?qry=Hadoop:service=NameNode,name=NameNodeStatus'
-    WEBHDFS = 'http://{{host}}:{{port}}/webhdfs/v1/{0}'
-    MAKEDIRS = '?op=MKDIRS'
-    DELETE = '?op=DELETE&recursive={0}'
-    RENAME = '?op=RENAME&destination={0}'
-    CREATE = '?op=CREATE&overwrite={0}'
-    LISTDIR = '?op=LISTSTATUS'
-    OPEN = '?op=OPEN'
-    STATUS = '?op=GETFILESTATUS'
+    WEBHDFS = 'http://{host}:{port}/webhdfs/v1/'
+
+
+class Operation(object):
+    MAKEDIRS = 'MKDIRS'
+    DELETE = 'DELETE'
+    RENAME = 'RENAME'
+    CREATE = 'CREATE'
+    LISTDIR = 'LISTSTATUS'
+    OPEN = 'OPEN'
+    STATUS = 'GETFILESTATUS'
 
 
 class DataType(object):
@@ -53,110 +84,281 @@ def retry_request(exceptions, default_return_value=ResultValue.NOTHING, default_
 
 class HDFSClient(object):
 
-    def __init__(self, namenodes):
+    _session_cache = {}
+    _session_cache_lock = threading.Lock()
+
+    def __init__(self, namenodes, max_workers=DEFAULT_MAX_WORKERS):
         """Create an instance of HDFSClient for use
 
         Args:
           namenodes (iterable of `NameNode`): a list(limit 1~2) of NameNode objects.
+          max_workers (int): number of threads used to transfer files of a directory.
 
         """
         if len(namenodes) == 0 or len(namenodes) > 2:
             raise ValueError('length of namenodes should in range(1, 2)')
+        if max_workers < 1:
+            raise ValueError('max_workers should be a positive integer')
 
         self._nns = namenodes
+        self._session = self._get_session(namenodes, max(DEFAULT_POOL_MAXSIZE, max_workers))
+        self._transfer_pool = ThreadPoolExecutor(max_workers=max_workers)
+        # Listings get their own workers, so they don't wait behind queued transfers
+        self._list_pool = ThreadPoolExecutor(max_workers=min(max_workers, LIST_MAX_WORKERS))
+        self._probe_pool = ThreadPoolExecutor(max_workers=len(namenodes))
+        self._stat_cache = {}
+        self._stat_cache_lock = threading.Lock()
+        self._stat_cache_version = 0
+        self._refresh_lock = threading.Lock()
+        self._last_refresh_ts = None
         self._refresh_active_namenode()
 
+    def close(self):
+        self._transfer_pool.shutdown(wait=True)
+        self._list_pool.shutdown(wait=True)
+        self._probe_pool.shutdown(wait=True)
+
+    @classmethod
+    def _get_session(cls, namenodes, pool_maxsize):
+        # Keep a connection per transfer worker, otherwise connections over
+        # the pool size are dropped after every request. Pool size is fixed
+        # once created, so clients needing a larger one get their own session
+        key = (frozenset(namenodes), pool_maxsize)
+        with cls._session_cache_lock:
+            session = cls._session_cache.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = SendfileAdapter(pool_connections=DEFAULT_POOL_CONNECTIONS,
+                                          pool_maxsize=pool_maxsize,
+                                          max_retries=0,
+                                          pool_block=False)
+                session.mount('http://', adapter)
+                cls._session_cache[key] = session
+        return session
+
     def request_error_trigger(self, err, is_final):
         if is_final:
             logger.error('Can\'t send request, error message:\n{}'.format(str(err)))
         else:
             logger.warn('Can\'t send request, error message:\n{}, try to refresh \
                          active HDFS NameNode and send request again'.format(str(err)))
-            self._refresh_active_namenode()
+            self._refresh_active_namenode_once()
+
+    def _refresh_active_namenode_once(self):
+        # Transfer threads fail together on a failover, only the first of them
+        # has to look for the new active namenode
+        last_refresh_ts = self._last_refresh_ts
+        with self._refresh_lock:
+            if self._last_refresh_ts == last_refresh_ts:
+                self._refresh_active_namenode()
 
     @retry_request((RequestException, ActiveNamenodeNotFoundException), default_trigger=empty_trigger)
     def _refresh_active_namenode(self):
 
-        active_index = None
-
-        for index, nn in enumerate(self._nns):
-            url = QueryURL.NAMENODE_STATUS.format(host=nn.host, port=nn.port)
-            response = requests.get(url)
-            if response.ok and u'active' in response.content:
-                active_index = index
+        active_namenode = None
+
+        futures = dict((self._probe_pool.submit(self._is_active_namenode, nn), nn)
+                       for nn in self._nns)
+        for future in as_completed(futures):
+            try:
+                is_active = future.result()
+            except RequestException as err:
+                logger.warn('Can\'t query NameNode status, error message:\n{}'.format(str(err)))
+                continue
+            if is_active:
+                active_namenode = futures[future]
                 break
 
-        if active_index is None:
-            raise  ActiveNamenodeNotFoundException('Can\'t find active namenode')
+        for future in futures:
+            future.cancel()
 
-        if active_index == 1:
-            self._nns.reverse()
+        if active_namenode is None:
+            raise  ActiveNamenodeNotFoundException('Can\'t find active namenode')
 
-        self._active_namenode = self._nns[0]
+        self._active_namenode = active_namenode
+        self._base_url = QueryURL.WEBHDFS.format(host=self._active_namenode.host,
+                                                 port=self._active_namenode.port)
         self._last_refresh_ts = time()
 
-    def _format_namenode(self, url):
-        return url.format(host=self._active_namenode.host,
-                          port=self._active_namenode.port)
-
-    def _send_request(self, url, request_method, **kwargs):
-        request_url = self._format_namenode(url)
-        response = request_method(request_url, **kwargs)
-        return response
+    def _is_active_namenode(self, nn):
+        url = QueryURL.NAMENODE_STATUS.format(host=nn.host, port=nn.port)
+        is_active = False
+        with closing(self._session.get(url, timeout=NAMENODE_STATUS_TIMEOUT, stream=True)) as response:
+            if response.ok:
+                tail = b''
+                for chunk in response.iter_content(NAMENODE_STATUS_CHUNK_SIZE):
+                    content = tail + chunk
+                    if NAMENODE_ACTIVE_PATTERN.search(content):
+                        is_active = True
+                        break
+                    tail = content[-NAMENODE_STATUS_CHUNK_SIZE:]
+
+        return is_active
+
+    def _url(self, path, op, **params):
+        query = ''.join('&{0}={1}'.format(key, value) for key, value in params.items())
+        return self._base_url + path.lstrip('/') + '?op=' + op + query
 
     def _send_simple_request(self, url, request_method):
-        response = self._send_request(url, request_method)
-        is_success = response.ok
-        response.close()
-        return is_success
+        with closing(request_method(url)) as response:
+            return response.ok
 
     @retry_request(RequestException, False)
     def makedirs(self, path):
-        url = urljoin(QueryURL.WEBHDFS.format(path.lstrip('/')),
-                      QueryURL.MAKEDIRS)
-        return self._send_simple_request(url, requests.put)
+        is_success = self._send_simple_request(self._url(path, Operation.MAKEDIRS), self._session.put)
+        if is_success:
+            self._set_cached_type(path, DataType.DIRECTORY, with_parents=True)
+        else:
+            self._invalidate_stat_cache(path)
+        return is_success
 
-    @retry_request(RequestException, False)
     def rename(self, src, dst):
-        url = urljoin(QueryURL.WEBHDFS.format(src.lstrip('/')),
-                      QueryURL.RENAME.format(dst))
-        return self._send_simple_request(url, requests.put)
+        return bool(self._rename(src, dst))
+
+    @retry_request(RequestException, None)
+    def _rename(self, src, dst):
+        data_type = self._get_cached_type(src)
+        # RENAME onto an existing directory moves src into it, so dst can only
+        # be cached as src when it is known to be absent
+        dst_parent, dst_name = os_path.split(dst.strip('/'))
+        dst_children = self._get_cached_children(dst_parent)
+        is_new_dst = dst_children is not None and dst_name not in dst_children
+
+        # RENAME answers 200 with a false boolean when the destination exists,
+        # that is a conflict to report rather than a failure to retry
+        with closing(self._session.put(self._url(src, Operation.RENAME, destination=dst))) as response:
+            is_success = json_loads(response.content)['boolean'] if response.ok else None
+        if is_success:
+            self._drop_cached_listings(src)
+            self._set_cached_type(src, None)
+            if data_type is not None and is_new_dst:
+                self._drop_cached_listings(dst)
+                self._set_cached_type(dst, data_type)
+            else:
+                self._invalidate_stat_cache(dst)
+        else:
+            self._invalidate_stat_cache(src)
+            self._invalidate_stat_cache(dst)
+        return is_success
 
     @retry_request(RequestException, False)
     def delete(self, path, recursive=False):
-        url = urljoin(QueryURL.WEBHDFS.format(path.lstrip('/')),
-                      QueryURL.DELETE.format(recursive))
-        return self._send_simple_request(url, requests.delete)
+        is_success = self._send_simple_request(self._url(path, Operation.DELETE, recursive=recursive),
+                                               self._session.delete)
+        if is_success:
+            self._drop_cached_listings(path)
+            self._set_cached_type(path, None)
+        else:
+            self._invalidate_stat_cache(path)
+        return is_success
 
     @retry_request(RequestException, None)
     def listdir(self, path):
-        url = urljoin(QueryURL.WEBHDFS.format(path.lstrip('/')),
-                      QueryURL.LISTDIR)
-
-        response = self._send_request(url, requests.get)
-        if response.ok:
-            data_list = json.loads(response.content)[u'FileStatuses'][u'FileStatus']
-            response.close()
-            dirs = tuple(d[u'pathSuffix'] for d in data_list if d[u'type'] == DataType.DIRECTORY and d[u'pathSuffix'])
-            files = tuple(f[u'pathSuffix'] for f in data_list if f[u'type'] == DataType.FILE and f[u'pathSuffix'])
-            hdfs_data = HDFSData(dirs=dirs, files=files)
+        data_list = self._list_status(path)
+        if data_list is not None:
+            dirs, files = [], []
+            for status in data_list:
+                suffix = status['pathSuffix']
+                if not suffix:
+                    continue
+                data_type = status['type']
+                if data_type == DataType.DIRECTORY:
+                    dirs.append(suffix)
+                elif data_type == DataType.FILE:
+                    files.append(suffix)
+            hdfs_data = HDFSData(tuple(dirs), tuple(files))
             return hdfs_data
         else:
-            response.close()
             return None
 
+    def _list_status(self, path):
+        version = self._stat_cache_version
+        with closing(self._session.get(self._url(path, Operation.LISTDIR))) as response:
+            if response.ok:
+                data_list = json_loads(response.content)['FileStatuses']['FileStatus']
+            else:
+                return None
+
+        children = dict((d['pathSuffix'], d['type']) for d in data_list if d['pathSuffix'])
+        with self._stat_cache_lock:
+            # Cache changed while listing, the result may miss that change
+            if version == self._stat_cache_version:
+                if len(self._stat_cache) >= STAT_CACHE_SIZE:
+                    self._prune_stat_cache()
+                self._stat_cache[path.strip('/')] = (time(), children)
+        return data_list
+
     def _get_remote_data_type(self, path):
-        url = urljoin(QueryURL.WEBHDFS.format(path.lstrip('/')),
-                      QueryURL.STATUS)
-
-        response = self._send_request(url, requests.get)
-        if response.ok:
-            status = json.loads(response.content)[u'FileStatus']
-            response.close()
-            return status[u'type']
-        else:
-            response.close()
+        parent, name = os_path.split(path.strip('/'))
+        if name:
+            # One listing of the parent answers the lookups of all its children
+            children = self._get_cached_children(parent)
+            if children is None:
+                data_list = self._list_status(parent)
+                if data_list is not None:
+                    children = dict((d['pathSuffix'], d['type']) for d in data_list)
+            if children is not None:
+                return children.get(name)
+
+        with closing(self._session.get(self._url(path, Operation.STATUS))) as response:
+            if response.ok:
+                return json_loads(response.content)['FileStatus']['type']
+            else:
+                return None
+
+    def _get_cached_children(self, parent):
+        cached = self._stat_cache.get(parent)
+        if cached is not None and time() - cached[0] < STAT_CACHE_TTL:
+            return cached[1]
+        return None
+
+    def _prune_stat_cache(self):
+        now = time()
+        for key, cached in list(self._stat_cache.items()):
+            if now - cached[0] >= STAT_CACHE_TTL:
+                self._stat_cache.pop(key, None)
+        if len(self._stat_cache) >= STAT_CACHE_SIZE:
+            self._stat_cache.clear()
+
+    def _get_cached_type(self, path):
+        parent, name = os_path.split(path.strip('/'))
+        children = self._get_cached_children(parent)
+        if children is None:
             return None
+        return children.get(name)
+
+    def _set_cached_type(self, path, data_type, with_parents=False):
+        path = path.strip('/')
+        with self._stat_cache_lock:
+            self._stat_cache_version += 1
+            while path:
+                parent, name = os_path.split(path)
+                cached = self._stat_cache.get(parent)
+                if cached is not None:
+                    if data_type is None:
+                        cached[1].pop(name, None)
+                    else:
+                        cached[1][name] = data_type
+                if not with_parents:
+                    break
+                path, data_type = parent, DataType.DIRECTORY
+
+    def _drop_cached_listings(self, path):
+        path = path.strip('/')
+        with self._stat_cache_lock:
+            self._stat_cache_version += 1
+            for key in list(self._stat_cache):
+                if key == path or key.startswith(path + '/'):
+                    self._stat_cache.pop(key, None)
+
+    def _invalidate_stat_cache(self, path):
+        path = path.strip('/')
+        with self._stat_cache_lock:
+            self._stat_cache_version += 1
+            for key in list(self._stat_cache):
+                if (key == path or key.startswith(path + '/') or
+                        not key or path.startswith(key + '/')):
+                    self._stat_cache.pop(key, None)
 
     def _get_local_data_type(self, path):
         if os_path.exists(path):
@@ -167,7 +369,8 @@ class HDFSClient(object):
         return None
 
     def upload(self, local_path, remote_path, overwrite=False):
-        if not overwrite and self._get_remote_data_type(remote_path) is not None:
+        remote_exists = self._get_remote_data_type(remote_path) is not None
+        if not overwrite and remote_exists:
             logger.error('Upload target path already exists: {}'.format(remote_path))
             return False
 
@@ -176,17 +379,25 @@ class HDFSClient(object):
             logger.error('Can\'t identify local data: {}'.format(local_path))
             return False
         else:
-            return self._upload_by_tmp_data(local_path, remote_path, data_type)
+            return self._upload_by_tmp_data(local_path, remote_path, data_type, remote_exists, overwrite)
 
-    def _upload_by_tmp_data(self, local_path, remote_path, data_type):
+    def _upload_by_tmp_data(self, local_path, remote_path, data_type, remote_exists, overwrite):
         remote_tmp_path = self._generate_tmp_path(remote_path)
 
         is_success = self._upload_data(local_path, remote_tmp_path, data_type)
 
         if is_success:
-            self._check_and_remove_remote_data(remote_path)
-            self.rename(remote_tmp_path, remote_path)
-        else:
+            if remote_exists:
+                self.delete(remote_path, True)
+            is_success = self.rename(remote_tmp_path, remote_path)
+            if not is_success and overwrite:
+                # Target may be created by another writer after it was checked
+                self._check_and_remove_remote_data(remote_path)
+                is_success = self.rename(remote_tmp_path, remote_path)
+            if not is_success:
+                logger.error('Can\'t move uploaded data to target path: {}'.format(remote_path))
+
+        if not is_success:
             self._check_and_remove_remote_data(remote_tmp_path)
 
         return is_success
@@ -202,28 +413,73 @@ class HDFSClient(object):
 
     def _upload_directory(self, local_path, remote_path):
         is_success = True
-        prefix_length = len(local_path) + 1
-        self.makedirs(remote_path)
-
-        for local_root, dirs, files in os.walk(local_path):
-            remote_root = path_join(remote_path, local_root[prefix_length:])
-            for d in dirs:
-                is_success &= self.makedirs(path_join(remote_root, d))
-            for f in files:
-                is_success &= self._upload_file(path_join(local_root, f), path_join(remote_root, f))
+
+        # Files are uploaded while the tree is still being scanned, CREATE makes
+        # missing parents by itself
+        relative_dirs = []
+        file_futures = []
+        try:
+            for local_data_path, relative_path, is_dir in self._iter_local_tree(local_path):
+                if is_dir:
+                    relative_dirs.append(relative_path)
+                else:
+                    file_futures.append(self._transfer_pool.submit(self._upload_file, local_data_path,
+                                                                   path_join(remote_path, relative_path)))
+        except OSError as err:
+            logger.error('Can\'t scan local directory, error message:\n{}'.format(str(err)))
+            # Let uploads already running finish before the tmp data is removed
+            for future in file_futures:
+                future.cancel()
+            wait(file_futures)
+            return False
+
+        # MKDIRS creates intermediate directories, so only leaves need a request
+        parent_dirs = set(os_path.dirname(d) for d in relative_dirs)
+        leaf_dirs = [path_join(remote_path, d) for d in relative_dirs if d not in parent_dirs]
+        dir_futures = [self._transfer_pool.submit(self.makedirs, d) for d in leaf_dirs or [remote_path]]
+
+        is_success &= all([future.result() for future in dir_futures])
+        is_success &= all([future.result() for future in file_futures])
         return is_success
 
+    def _iter_local_tree(self, root):
+        dir_queue = deque([''])
+        while dir_queue:
+            relative_root = dir_queue.popleft()
+            entries = scandir(path_join(root, relative_root))
+            try:
+                for entry in entries:
+                    relative_path = path_join(relative_root, entry.name)
+                    if entry.is_dir():
+                        yield entry.path, relative_path, True
+                        if not entry.is_symlink():
+                            dir_queue.append(relative_path)
+                    else:
+                        yield entry.path, relative_path, False
+            finally:
+                # Iterator from Python < 3.6 can't be closed explicitly
+                if hasattr(entries, 'close'):
+                    entries.close()
+
     @retry_request(RequestException, False)
     def _upload_file(self, local_path, remote_path):
         is_success = False
-        url = urljoin(QueryURL.WEBHDFS.format(remote_path.lstrip('/')),
-                      QueryURL.CREATE.format(True))
-
-        with open(local_path, 'rb') as f:
-            file_name = os_path.basename(remote_path)
-            response = self._send_request(url, requests.put, files={file_name: f})
-            is_success = response.ok
-            response.close()
+        # Ask NameNode for the DataNode location first, a streamed body can't be
+        # replayed when following the redirect
+        url = self._url(remote_path, Operation.CREATE, overwrite=True)
+        with closing(self._session.put(url, allow_redirects=False)) as response:
+            if not response.is_redirect:
+                return is_success
+            location = response.headers['Location']
+
+        headers = {'Content-Type': 'application/octet-stream'}
+        with open(local_path, 'rb', UPLOAD_BUFFER_SIZE) as f:
+            with closing(self._session.put(location, data=f, headers=headers)) as response:
+                is_success = response.ok
+        if is_success:
+            self._set_cached_type(remote_path, DataType.FILE, with_parents=True)
+        else:
+            self._invalidate_stat_cache(remote_path)
 
         return is_success
 
@@ -248,7 +504,7 @@ class HDFSClient(object):
             self._check_and_remove_local_data(local_path)
             os.rename(local_tmp_path, local_path)
         else:
-            self._check_and_remove_data(local_tmp_path)
+            self._check_and_remove_local_data(local_tmp_path)
 
         return is_success
 
@@ -263,37 +519,48 @@ class HDFSClient(object):
 
     def _download_directory(self, remote_path, local_path):
         is_success = True
-        dir_queue = deque([''])
-        while len(dir_queue) and is_success:
-            current_dir = dir_queue.popleft()
-            remote_dir_path = path_join(remote_path, current_dir)
-            local_dir_path = path_join(local_path, current_dir)
-            os.makedirs(local_dir_path)
-
-            data_status = self.listdir(remote_dir_path)
-            for d in data_status.dirs:
-                dir_queue.append(path_join(current_dir, d))
-            for f in data_status.files:
-                is_success &= self._download_file(path_join(remote_dir_path, f),
-                                                  path_join(local_dir_path, f))
+        file_futures = []
+        current_level = ['']
+        while current_level and is_success:
+            for current_dir in current_level:
+                os.makedirs(path_join(local_path, current_dir))
+
+            remote_dir_paths = [path_join(remote_path, d) for d in current_level]
+            next_level = []
+            for current_dir, data_status in zip(current_level,
+                                                self._list_pool.map(self.listdir, remote_dir_paths)):
+                if data_status is None:
+                    is_success = False
+                    break
+                remote_dir_path = path_join(remote_path, current_dir)
+                local_dir_path = path_join(local_path, current_dir)
+                for d in data_status.dirs:
+                    next_level.append(path_join(current_dir, d))
+                for f in data_status.files:
+                    file_futures.append(self._transfer_pool.submit(self._download_file,
+                                                                   path_join(remote_dir_path, f),
+                                                                   path_join(local_dir_path, f)))
+            current_level = next_level
+
+        is_success &= all([future.result() for future in file_futures])
         return is_success
 
     @retry_request((RequestException, IOError), False)
     def _download_file(self, remote_path, local_path):
-        url = urljoin(QueryURL.WEBHDFS.format(remote_path.lstrip('/')),
-                      QueryURL.OPEN)
-
-        response = self._send_request(url, requests.get)
-        is_success = response.ok
-        if is_success:
-            self._write_content(response, local_path)
+        with closing(self._session.get(self._url(remote_path, Operation.OPEN), stream=True)) as response:
+            is_success = response.ok
+            if is_success:
+                self._write_content(response, local_path)
+            else:
+                # Drain the error body so the connection can go back to the pool
+                response.content
 
-        response.close()
         return is_success
 
     def _write_content(self, response, path):
+        # iter_content turns broken or truncated bodies into RequestException
         with open(path, 'wb') as f:
-            for chunk in response:
+            for chunk in response.iter_content(DOWNLOAD_BUFFER_SIZE):
                 f.write(chunk)
 
     def _check_and_remove_local_data(self, path):
@@ -0,0 +1,95 @@
+import os
+import socket
+import stat
+
+from requests.adapters import HTTPAdapter, DEFAULT_POOL_TIMEOUT, TimeoutSauce
+from requests.exceptions import ConnectionError, ConnectTimeout, ReadTimeout
+from requests.packages.urllib3.exceptions import ConnectTimeoutError, NewConnectionError, ReadTimeoutError
+from requests.packages.urllib3.response import HTTPResponse
+
+# The low-level send path needs urllib3 1.x, which builds responses from httplib
+HAS_SENDFILE = (hasattr(socket.socket, 'sendfile') and
+                hasattr(HTTPResponse, 'from_httplib'))
+
+
+class SendfileAdapter(HTTPAdapter):
+    """HTTPAdapter which sends regular file bodies by socket.sendfile
+
+    The sendfile path drives the pooled connection itself and needs urllib3 1.x
+    (as vendored by the pinned requests). With urllib3 2.x, or without
+    socket.sendfile, every request goes through the stock HTTPAdapter.send.
+    """
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if not self._can_sendfile(request):
+            return super(SendfileAdapter, self).send(request, stream=stream, timeout=timeout,
+                                                     verify=verify, cert=cert, proxies=proxies)
+
+        conn = self.get_connection(request.url, proxies)
+        if hasattr(conn, 'proxy_pool'):
+            return super(SendfileAdapter, self).send(request, stream=stream, timeout=timeout,
+                                                     verify=verify, cert=cert, proxies=proxies)
+
+        self.cert_verify(conn, request.url, verify, cert)
+        url = self.request_url(request, proxies)
+        self.add_headers(request)
+
+        if isinstance(timeout, tuple):
+            connect_timeout, read_timeout = timeout
+        else:
+            connect_timeout = read_timeout = timeout
+        timeout = TimeoutSauce(connect=connect_timeout, read=read_timeout)
+
+        try:
+            low_conn = conn._get_conn(timeout=DEFAULT_POOL_TIMEOUT)
+            try:
+                # Like urllib3, the request is sent under the connect timeout
+                low_conn.timeout = timeout.connect_timeout
+                if low_conn.sock is not None:
+                    low_conn.sock.settimeout(timeout.connect_timeout)
+                low_conn.putrequest(request.method, url, skip_accept_encoding=True)
+                for header, value in request.headers.items():
+                    low_conn.putheader(header, value)
+                low_conn.endheaders()
+
+                low_conn.sock.sendfile(request.body)
+
+                low_conn.sock.settimeout(timeout.read_timeout)
+                try:
+                    httplib_response = low_conn.getresponse()
+                except socket.timeout:
+                    raise ReadTimeoutError(conn, url, 'Read timed out. (read timeout={})'.format(
+                        timeout.read_timeout))
+
+                resp = HTTPResponse.from_httplib(httplib_response,
+                                                 pool=conn,
+                                                 connection=low_conn,
+                                                 preload_content=False,
+                                                 decode_content=False)
+            except:
+                # Hand the closed connection back, so the pool keeps its size
+                low_conn.close()
+                conn._put_conn(low_conn)
+                raise
+        except NewConnectionError as err:
+            raise ConnectionError(err, request=request)
+        except ConnectTimeoutError as err:
+            raise ConnectTimeout(err, request=request)
+        except ReadTimeoutError as err:
+            raise ReadTimeout(err, request=request)
+        except socket.error as err:
+            raise ConnectionError(err, request=request)
+
+        return self.build_response(request, resp)
+
+    def _can_sendfile(self, request):
+        if not HAS_SENDFILE or 'Content-Length' not in request.headers:
+            return False
+        if not request.url.lower().startswith('http://'):
+            return False
+
+        try:
+            fileno = request.body.fileno()
+        except (AttributeError, IOError, OSError):
+            return False
+        return stat.S_ISREG(os.fstat(fileno).st_mode)
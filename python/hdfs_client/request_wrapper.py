@@ -2,7 +2,7 @@ DEFAULT_ERROR_BOUNDARY = 3
 
 
 class ResultValue(object):
-    NOTHING = 1
+    NOTHING = object()
 
 
 def empty_trigger(url, ex, is_final):
@@ -22,7 +22,7 @@ class RetryAction(object):
         while not self._is_error_count_exceed_boundary():
             try:
                 result = self._func(*args, **kwargs)
-                if result == self._default_return_value:
+                if result is self._default_return_value:
                     error_message = ('Result return by function "{func}" is the default value, '.format(func=self._func.__name__) +
                                      'may be encounter some problem while execute')
                     self._error_handle(error_message)
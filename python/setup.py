@@ -5,8 +5,16 @@ from pip.req import parse_requirements
 __version__ = '0.1.0'
 __author__ = 'ShuTong'
 
+
+def format_requirement(ir):
+    # Environment markers are kept apart from ir.req, put them back
+    if getattr(ir, 'markers', None):
+        return '{0}; {1}'.format(ir.req, ir.markers)
+    return str(ir.req)
+
+
 install_reqs = parse_requirements('requirements.txt', session=uuid.uuid1)
-reqs = [str(ir.req) for ir in install_reqs]
+reqs = [format_requirement(ir) for ir in install_reqs]
 
 setup(
     name='HDFSTools',
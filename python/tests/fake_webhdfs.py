@@ -0,0 +1,162 @@
+import json
+import posixpath
+import threading
+from collections import Counter
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs, unquote
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+    from urllib import unquote
+
+
+def normalize(path):
+    return posixpath.normpath('/' + path).strip('/') if path.strip('/') else ''
+
+
+class FakeWebHDFSHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._handle()
+
+    def do_PUT(self):
+        self._handle()
+
+    def do_DELETE(self):
+        self._handle()
+
+    def _reply(self, code, body=b'', headers=None):
+        if isinstance(body, dict):
+            body = json.dumps(body, indent=2).encode('utf-8')
+        self.send_response(code)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _redirect_to_datanode(self):
+        location = 'http://127.0.0.1:{0}{1}&datanode=true'.format(self.server.server_port, self.path)
+        self._reply(307, headers={'Location': location})
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            data = b''
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return data
+                data += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _status(self, path, suffix):
+        data = self.server.fs[path]
+        return {'pathSuffix': suffix, 'type': 'DIRECTORY' if data is None else 'FILE'}
+
+    def list_status(self, path):
+        fs = self.server.fs
+        if fs[path] is not None:
+            return {'FileStatuses': {'FileStatus': [self._status(path, '')]}}
+        prefix = path + '/' if path else ''
+        children = sorted(k for k in fs if k and k.startswith(prefix) and '/' not in k[len(prefix):])
+        statuses = [self._status(k, k[len(prefix):]) for k in children]
+        return {'FileStatuses': {'FileStatus': statuses}}
+
+    def _handle(self):
+        server = self.server
+        url = urlparse(self.path)
+        query = dict((key, value[0]) for key, value in parse_qs(url.query).items())
+        if url.path == '/jmx':
+            state = 'active' if server.active else 'standby'
+            return self._reply(200, {'beans': [{'State': state}]})
+
+        path = normalize(unquote(url.path[len('/webhdfs/v1/'):]))
+        op = query['op']
+        if 'datanode' not in query:
+            server.ops[op] += 1
+        hook = server.hooks.get(op)
+        if hook is not None and hook(self, path, query):
+            return
+
+        fs = server.fs
+        with server.lock:
+            if op == 'MKDIRS':
+                server.make_parents(path)
+                return self._reply(200, {'boolean': True})
+            if op == 'GETFILESTATUS':
+                if path not in fs:
+                    return self._reply(404, {'RemoteException': {}})
+                return self._reply(200, {'FileStatus': self._status(path, '')})
+            if op == 'LISTSTATUS':
+                if path not in fs:
+                    return self._reply(404, {'RemoteException': {}})
+                return self._reply(200, self.list_status(path))
+            if op == 'DELETE':
+                existed = path in fs
+                for key in [k for k in fs if k == path or k.startswith(path + '/')]:
+                    del fs[key]
+                return self._reply(200, {'boolean': existed})
+            if op == 'RENAME':
+                dst = normalize(query['destination'])
+                if dst in fs and fs[dst] is None:
+                    dst = posixpath.join(dst, posixpath.basename(path))
+                if path not in fs or dst in fs:
+                    return self._reply(200, {'boolean': False})
+                for key in [k for k in fs if k == path or k.startswith(path + '/')]:
+                    fs[dst + key[len(path):]] = fs.pop(key)
+                return self._reply(200, {'boolean': True})
+
+        if op == 'CREATE':
+            if 'datanode' not in query:
+                self._read_body()
+                return self._redirect_to_datanode()
+            data = self._read_body()
+            with server.lock:
+                server.make_parents(posixpath.dirname(path))
+                fs[path] = data
+            return self._reply(201)
+        if op == 'OPEN':
+            if 'datanode' not in query:
+                return self._redirect_to_datanode()
+            with server.lock:
+                data = fs.get(path)
+            if data is None:
+                return self._reply(404, {'RemoteException': {}})
+            return self._reply(200, data, {'Content-Type': 'application/octet-stream'})
+        return self._reply(400, {'RemoteException': {}})
+
+
+class FakeWebHDFSServer(ThreadingMixIn, HTTPServer):
+    """In-memory WebHDFS NameNode and DataNode serving on a random local port"""
+
+    daemon_threads = True
+
+    def __init__(self, active=True):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeWebHDFSHandler)
+        self.active = active
+        self.fs = {'': None}
+        self.ops = Counter()
+        self.hooks = {}
+        self.lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def make_parents(self, path):
+        parts = path.split('/') if path else []
+        for index in range(1, len(parts) + 1):
+            self.fs.setdefault('/'.join(parts[:index]), None)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,119 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import requests
+
+from hdfs_client import adapters
+from hdfs_client.adapters import SendfileAdapter
+
+
+class RecordHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_PUT(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.server.bodies.append(self.rfile.read(length))
+        if self.path == '/slow':
+            self.server.release.wait(5)
+            self.close_connection = True
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class SendfileAdapterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), RecordHandler)
+        self.server.bodies = []
+        self.server.release = threading.Event()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{0}/data'.format(self.server.server_port)
+
+        self.session = requests.Session()
+        self.session.mount('http://', SendfileAdapter())
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.payload = os.urandom(256 * 1024 + 3)
+        self.path = os.path.join(self.tmp_dir, 'payload')
+        with open(self.path, 'wb') as f:
+            f.write(self.payload)
+
+    def tearDown(self):
+        self.session.close()
+        self.server.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def _put_file(self):
+        with open(self.path, 'rb') as f:
+            return self.session.put(self.url, data=f)
+
+    @unittest.skipUnless(adapters.HAS_SENDFILE, 'sendfile path needs socket.sendfile and urllib3 1.x')
+    def test_sendfile_path(self):
+        with mock.patch.object(socket.socket, 'sendfile', autospec=True,
+                               side_effect=socket.socket.sendfile) as sendfile:
+            response = self._put_file()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(sendfile.call_count, 1)
+        self.assertEqual(self.server.bodies, [self.payload])
+
+    @unittest.skipUnless(adapters.HAS_SENDFILE, 'sendfile path needs socket.sendfile and urllib3 1.x')
+    def test_sendfile_path_read_timeout(self):
+        with mock.patch.object(socket.socket, 'sendfile', autospec=True,
+                               side_effect=socket.socket.sendfile) as sendfile:
+            with open(self.path, 'rb') as f:
+                with self.assertRaises(requests.exceptions.ReadTimeout):
+                    self.session.put(self.url.replace('/data', '/slow'), data=f, timeout=(1, 0.2))
+
+        self.assertEqual(sendfile.call_count, 1)
+        self.assertEqual(self.server.bodies, [self.payload])
+
+    @unittest.skipUnless(adapters.HAS_SENDFILE, 'sendfile path needs socket.sendfile and urllib3 1.x')
+    def test_sendfile_path_connection_refused(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        url = 'http://127.0.0.1:{0}/data'.format(sock.getsockname()[1])
+        sock.close()
+
+        with open(self.path, 'rb') as f:
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                self.session.put(url, data=f, timeout=(1, 1))
+
+    def test_fallback_path(self):
+        with mock.patch.object(adapters, 'HAS_SENDFILE', False):
+            response = self._put_file()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.server.bodies, [self.payload])
+
+    def test_non_file_body_uses_fallback(self):
+        response = self.session.put(self.url, data=b'content')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.server.bodies, [b'content'])
+
+
+if __name__ == '__main__':
+    unittest.main()
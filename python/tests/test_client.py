@@ -0,0 +1,162 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from time import time
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from hdfs_client import HDFSClient, NameNode, DataType, STAT_CACHE_TTL
+
+from fake_webhdfs import FakeWebHDFSServer
+
+logging.getLogger('hdfs_client').addHandler(logging.NullHandler())
+
+
+class HDFSClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeWebHDFSServer()
+        self.client = HDFSClient([NameNode('127.0.0.1', self.server.server_port)])
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def _local_file(self, name, content):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def _create_before_rename(self, content):
+        # Another writer creates the target between the existence check and RENAME
+        def hook(handler, path, query):
+            del self.server.hooks['RENAME']
+            self.server.fs.setdefault('data', content)
+        self.server.hooks['RENAME'] = hook
+
+    def test_upload_keeps_concurrently_created_target(self):
+        self._create_before_rename(b'other')
+
+        self.assertFalse(self.client.upload(self._local_file('data', b'mine'), '/data'))
+        self.assertEqual(self.server.fs['data'], b'other')
+        self.assertEqual(self.server.ops['RENAME'], 1)
+        self.assertEqual([k for k in self.server.fs if k.endswith('_tmp')], [])
+
+    def test_upload_replaces_concurrently_created_target_when_overwriting(self):
+        self._create_before_rename(b'other')
+
+        self.assertTrue(self.client.upload(self._local_file('data', b'mine'), '/data', overwrite=True))
+        self.assertEqual(self.server.fs['data'], b'mine')
+        self.assertEqual([k for k in self.server.fs if k.endswith('_tmp')], [])
+
+    def test_download_fails_on_truncated_body(self):
+        self.server.fs['data'] = b'content'
+
+        def hook(handler, path, query):
+            if 'datanode' not in query:
+                return False
+            handler.send_response(200)
+            handler.send_header('Transfer-Encoding', 'chunked')
+            handler.end_headers()
+            handler.wfile.write(b'100\r\npartial')
+            handler.close_connection = True
+            return True
+        self.server.hooks['OPEN'] = hook
+
+        local_path = os.path.join(self.tmp_dir, 'data')
+        self.assertFalse(self.client.download('/data', local_path))
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_sibling_lookups_share_one_listing(self):
+        self.server.make_parents('dir')
+        self.server.fs['dir/old'] = b'old'
+
+        for name in ('a', 'b', 'c'):
+            self.assertTrue(self.client.upload(self._local_file(name, b'new'), '/dir/' + name))
+        self.assertFalse(self.client.upload(self._local_file('old', b'new'), '/dir/old'))
+
+        self.assertEqual(self.server.ops['LISTSTATUS'], 1)
+        self.assertEqual(self.server.ops['GETFILESTATUS'], 0)
+
+    def test_stat_cache_expires(self):
+        self.server.make_parents('dir')
+        self.assertIsNone(self.client._get_remote_data_type('/dir/data'))
+        self.server.fs['dir/data'] = b'other'
+
+        self.assertIsNone(self.client._get_remote_data_type('/dir/data'))
+        with mock.patch('hdfs_client.time', return_value=time() + STAT_CACHE_TTL):
+            self.assertEqual(self.client._get_remote_data_type('/dir/data'), DataType.FILE)
+        self.assertEqual(self.server.ops['LISTSTATUS'], 2)
+
+    def test_rename_into_existing_directory(self):
+        self.server.make_parents('dir/sub')
+        self.server.fs['dir/data'] = b'content'
+        self.client.listdir('/dir')
+
+        self.assertTrue(self.client.rename('/dir/data', '/dir/sub'))
+        self.assertIsNone(self.client._get_remote_data_type('/dir/data'))
+        self.assertEqual(self.client._get_remote_data_type('/dir/sub'), DataType.DIRECTORY)
+        self.assertEqual(self.client._get_remote_data_type('/dir/sub/data'), DataType.FILE)
+
+    def test_delete_updates_cached_listing(self):
+        self.server.make_parents('dir')
+        self.server.fs['dir/data'] = b'content'
+        self.assertEqual(self.client._get_remote_data_type('/dir/data'), DataType.FILE)
+
+        self.assertTrue(self.client.delete('/dir/data'))
+        self.assertIsNone(self.client._get_remote_data_type('/dir/data'))
+        self.assertEqual(self.server.ops['LISTSTATUS'], 1)
+
+    def test_listing_racing_a_change_is_not_cached(self):
+        self.server.make_parents('dir')
+
+        # The directory is made after the listing is taken but before it is answered
+        def hook(handler, path, query):
+            del self.server.hooks['LISTSTATUS']
+            body = handler.list_status(path)
+            self.assertTrue(self.client.makedirs('/dir/new'))
+            handler._reply(200, body)
+            return True
+        self.server.hooks['LISTSTATUS'] = hook
+
+        self.assertIsNone(self.client._get_remote_data_type('/dir/data'))
+        self.assertEqual(self.client._get_remote_data_type('/dir/new'), DataType.DIRECTORY)
+
+    def test_download_lists_subdirectories_while_files_transfer(self):
+        client = HDFSClient([NameNode('127.0.0.1', self.server.server_port)], max_workers=1)
+        self.addCleanup(client.close)
+        self.server.make_parents('dir/sub')
+        self.server.fs['dir/a'] = b'a'
+        self.server.fs['dir/sub/b'] = b'b'
+
+        listed = threading.Event()
+        waits = []
+
+        def list_hook(handler, path, query):
+            if path == 'dir/sub':
+                listed.set()
+
+        def open_hook(handler, path, query):
+            if path == 'dir/a' and 'datanode' not in query:
+                waits.append(listed.wait(2))
+        self.server.hooks['LISTSTATUS'] = list_hook
+        self.server.hooks['OPEN'] = open_hook
+
+        local_path = os.path.join(self.tmp_dir, 'dir')
+        self.assertTrue(client.download('/dir', local_path))
+        self.assertEqual(waits, [True])
+        with open(os.path.join(local_path, 'sub', 'b'), 'rb') as f:
+            self.assertEqual(f.read(), b'b')
+
+
+if __name__ == '__main__':
+    unittest.main()